@@ -0,0 +1,64 @@
+"""
+Copyright (C) 2021 Erin Morelli.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see [https://www.gnu.org/licenses/].
+"""
+
+import json
+import zlib
+
+from sqlalchemy import (Table, Column, DateTime, Integer, LargeBinary,
+                        String, func)
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Prefer zstd when the optional package is installed
+DEFAULT_ENCODING = 'zstd' if zstandard else 'zlib'
+
+
+def compress(data, encoding=DEFAULT_ENCODING):
+    """Serialize and compress raw post attributes."""
+    raw = json.dumps(data, separators=(',', ':')).encode('utf-8')
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=10).compress(raw)
+    return zlib.compress(raw, 9)
+
+
+def decompress(blob, encoding):
+    """Decompress and deserialize raw post attributes."""
+    if encoding == 'zstd':
+        if not zstandard:
+            raise ValueError('The zstandard package is not installed')
+        raw = zstandard.ZstdDecompressor().decompress(blob)
+    else:
+        raw = zlib.decompress(blob)
+    return json.loads(raw)
+
+
+def table(metadata):
+    """Raw post archive database table definition."""
+    return Table(
+        'post_archive',
+        metadata,
+        Column('video_id', Integer, primary_key=True),
+        Column('post_id', String, nullable=True),
+        Column('encoding', String, nullable=False),
+        Column('data', LargeBinary, nullable=False),
+        Column('last_updated', DateTime, server_default=func.now(),
+               onupdate=func.now(), nullable=False)
+    )
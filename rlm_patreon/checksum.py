@@ -0,0 +1,71 @@
+"""
+Copyright (C) 2021 Erin Morelli.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see [https://www.gnu.org/licenses/].
+"""
+
+import os
+import mmap
+import hashlib
+
+try:
+    from blake3 import blake3
+except ImportError:
+    blake3 = None
+
+
+# Prefer BLAKE3 when the optional package is installed
+DEFAULT_ALGORITHM = 'blake3' if blake3 else 'sha256'
+# Size of each slice handed to the hash function
+BLOCK_SIZE = 8 * 1024 * 1024
+
+
+def new_hasher(algorithm=DEFAULT_ALGORITHM):
+    """Create a new incremental hash object."""
+    if algorithm == 'blake3':
+        if not blake3:
+            raise ValueError('The blake3 package is not installed')
+        return blake3(max_threads=blake3.AUTO)
+    return hashlib.new(algorithm)
+
+
+def format_checksum(hasher, algorithm=DEFAULT_ALGORITHM):
+    """Format a finished hash as an "algorithm:digest" string."""
+    return f'{algorithm}:{hasher.hexdigest()}'
+
+
+def parse_checksum(checksum):
+    """Split a stored checksum into its algorithm and digest."""
+    algorithm, _, digest = checksum.partition(':')
+    return algorithm, digest
+
+
+def hash_file(file_path, algorithm=DEFAULT_ALGORITHM):
+    """Hash a file using memory-mapped reads."""
+    hasher = new_hasher(algorithm)
+    with open(file_path, 'rb') as f:
+        # Empty files cannot be memory-mapped
+        if os.fstat(f.fileno()).st_size == 0:
+            return format_checksum(hasher, algorithm)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mm, 'madvise'):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            view = memoryview(mm)
+            try:
+                # Hash in large slices so the GIL is released for each one
+                for start in range(0, len(view), BLOCK_SIZE):
+                    hasher.update(view[start:start + BLOCK_SIZE])
+            finally:
+                view.release()
+    return format_checksum(hasher, algorithm)
@@ -16,9 +16,12 @@ along with this program.  If not, see [https://www.gnu.org/licenses/].
 """
 
 import os
+import re
+from urllib.parse import urlparse
 
 import click
 from requests import Session, RequestException, cookies
+from urllib3.util import make_headers
 
 from yaspin import yaspin
 from yaspin.spinners import Spinners
@@ -47,15 +50,25 @@ class PatreonContent:
         'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:89.0) '
                       'Gecko/20100101 Firefox/89.0'
     }
+    # API responses are JSON, so offer every compression urllib3 can decode
+    api_headers = make_headers(accept_encoding=True)
     # Set CLI details for account management
     command_help = 'Manage your Patreon account.'
     commands = ['login', 'update', 'show']
+    # Commands added directly to the top level of the CLI
+    root_commands = []
+    # Additional table definitions used by this content type
+    extra_tables = []
+    # Times to retry an API request the server asked us to slow down for
+    throttle_retries = 3
 
     def __init__(self, manager):
         """Setup details for content class."""
         self.manager = manager
         self.db = self.manager.get_session()
         self.model = self.manager.models.get(self.model_name)
+        # Number of response bytes received over the wire from the API
+        self.bytes_transferred = 0
 
     def auto_login_user(self, with_account=False):
         """Decorator to automatically log user in for CLI actions."""
@@ -79,10 +92,33 @@ class PatreonContent:
         jar.set('session_id', session_id, domain='patreon.com', path='/')
         # Add cookies and headers to session
         session.cookies = jar
-        session.headers = self.headers
+        session.headers = {**self.headers, **self.api_headers}
         # Return new session object
         return session
 
+    def _api_get(self, session, url, **kwargs):
+        """Make an API request and record the bytes it transferred."""
+        metrics = self.manager.metrics
+        # Group requests by path with any IDs removed
+        endpoint = re.sub(r'/\d+', '/:id', urlparse(url).path)
+        for attempt in range(self.throttle_retries + 1):
+            self.manager.rate_limiter.acquire('api')
+            with metrics.timer('api_request_seconds', endpoint=endpoint):
+                res = session.get(url, **kwargs)
+                # Read the body so the raw stream reports its compressed size
+                content = res.content
+            size = res.raw.tell() or len(content)
+            self.bytes_transferred += size
+            metrics.inc('api_requests_total', endpoint=endpoint,
+                        status=res.status_code)
+            metrics.inc('api_response_bytes_total', size, endpoint=endpoint)
+            if res.status_code != 429 or attempt == self.throttle_retries:
+                return res
+            # Hold back every process until the server's cool-down passes
+            retry_after = res.headers.get('Retry-After', '')
+            delay = int(retry_after) if retry_after.isdigit() else 30
+            self.manager.rate_limiter.penalize('api', delay)
+
     def _get_account(self):
         """Locate an account in the database."""
         model = self.manager.models.get('account')
@@ -112,7 +148,8 @@ class PatreonContent:
 
     def _check_session(self, account):
         """Check if the user's session ID is still valid."""
-        res = self.session(account.session_id).get(self.user_url)
+        res = self._api_get(self.session(account.session_id), self.user_url,
+                            params={'fields[user]': 'email'})
 
         try:
             # Check the results
@@ -154,7 +191,7 @@ class PatreonContent:
             return None
 
         # Store new session
-        account.session = session
+        account.session_id = session
         self.db.commit()
 
         # Return the logged in account
@@ -192,20 +229,33 @@ class PatreonContent:
         options = webdriver.chrome.options.Options()
         options.add_argument('headless')
 
-        # Load page in headless Chrome
-        driver = webdriver.Chrome(options=options)
-        driver.get(self.rlm_url)
+        # Browser logins are expensive and easily flagged, so share a budget
+        self.manager.rate_limiter.acquire('login')
 
-        # Wait for login JS to execute on the page
-        script = self._login_js % (email, password, self.login_endpoint)
-        WebDriverWait(driver, 10).until(lambda d: d.execute_script(script))
+        try:
+            # Load page in headless Chrome
+            driver = webdriver.Chrome(options=options)
+            driver.get(self.rlm_url)
+
+            # Wait for login JS to execute on the page
+            script = self._login_js % (email, password, self.login_endpoint)
+            WebDriverWait(driver, 10).until(
+                lambda d: d.execute_script(script))
+            browser_cookies = driver.get_cookies()
+        except Exception:
+            # Timeouts and browser errors are the usual failed logins
+            self.manager.metrics.inc('login_attempts_total', result='failure')
+            raise
 
         # Get the session ID from the browser cookies
-        for cookie in driver.get_cookies():
+        for cookie in browser_cookies:
             if cookie['name'] == 'session_id':
+                self.manager.metrics.inc('login_attempts_total',
+                                         result='success')
                 return cookie['value']
 
         # Handle login errors, usually due to device verification
+        self.manager.metrics.inc('login_attempts_total', result='failure')
         self.manager.error('Unable to login: device needs email verification')
         return None
 
@@ -16,21 +16,39 @@ along with this program.  If not, see [https://www.gnu.org/licenses/].
 """
 
 import os
+import re
+import json
+import time
+from difflib import get_close_matches
+from datetime import datetime, timezone
+from concurrent.futures import (ThreadPoolExecutor, ProcessPoolExecutor,
+                                as_completed)
 
 from urllib.parse import urlparse
 from textwrap import shorten, TextWrapper
 
 import click
 from tqdm import tqdm
+from yaspin import yaspin
+from yaspin.spinners import Spinners
+from requests import Session, RequestException, HTTPError
 from pyquery import PyQuery
 from dateutil import parser
 from tabulate import tabulate, tabulate_formats
 from vimeo_downloader import Vimeo, RequestError
 
 from sqlalchemy_utils.types import URLType
-from sqlalchemy import Table, Column, Date, DateTime, Integer, String, func
+from sqlalchemy import (Table, Column, Index, BigInteger, Date, DateTime,
+                        Integer, String, func, tuple_)
 
+from rlm_patreon import archive, postprocess
 from rlm_patreon.content import PatreonContent
+from rlm_patreon.checksum import hash_file, parse_checksum
+from rlm_patreon.download import SegmentedDownload, DownloadError
+from rlm_patreon.scan import DirectoryScanner
+from rlm_patreon.scheduler import PollScheduler
+from rlm_patreon.server import LibraryServer
+from rlm_patreon.thumbnails import ThumbnailCache
 
 from pprint import pprint
 
@@ -43,7 +61,26 @@ class VideoContent(PatreonContent):
     posts_url = f'{PatreonContent.base_url}/api/posts'
     # Set CLI details for videos
     command_help = 'Manage Patreon exclusive videos.'
-    commands = ['list', 'update', 'show', 'download', 'open']
+    commands = ['list', 'update', 'show', 'download', 'open', 'verify',
+                'thumbnail', 'watch', 'process', 'reparse', 'scan']
+    # Commands added directly to the top level of the CLI
+    root_commands = ['serve']
+    # Supporting data for thumbnails, outputs, raw posts and library scans
+    extra_tables = [ThumbnailCache.table, postprocess.table, archive.table,
+                    DirectoryScanner.table]
+    # Number of archived posts to reparse per database transaction
+    reparse_batch_size = 500
+    # Post fields needed to find video posts while scanning the archive
+    scan_fields = ['embed', 'post_type', 'published_at', 'title', 'url']
+    # Post fields only fetched for new videos when creating them
+    detail_fields = ['content', 'image', 'meta_image_url', 'thumbnail_url']
+
+    def __init__(self, manager):
+        """Setup details for video content."""
+        super().__init__(manager)
+        self.thumbnails = ThumbnailCache(manager, self.db, self.headers)
+        self.outputs = self.manager.models.get('video_outputs')
+        self.archive = self.manager.models.get('post_archive')
 
     def _update_videos(self, session_id, limit=25):
         """Add new video content to database."""
@@ -58,41 +95,57 @@ class VideoContent(PatreonContent):
         }
 
         # Get all video posts
-        with tqdm(**progress_bar) as pbar:
+        metrics = self.manager.metrics
+        with metrics.timer('sync_seconds'), tqdm(**progress_bar) as pbar:
             all_posts = self._get_video_posts(
                 session, pbar, limit, [], self.posts_url)
+        metrics.inc('posts_scanned_total', len(all_posts))
+
+        # Fetch full details for unknown videos before writing anything
+        new_posts = []
+        for post in all_posts:
+            if not self._find_video(post['title'], post['url']):
+                post.update(self._get_post_details(session, post['id']))
+                new_posts.append(post)
 
         # Add videos to the database
         added = []
-        for post in all_posts:
+        for post in new_posts:
             video = self._create_video(post)
             if video:
                 added.append(video)
                 self.db.add(video)
+                # Keep the raw post so columns can be rebuilt offline
+                self.db.flush()
+                self.db.add(self.archive(
+                    video_id=video.video_id,
+                    post_id=post['id'],
+                    encoding=archive.DEFAULT_ENCODING,
+                    data=archive.compress(post)
+                ))
 
         # Only commit the changes if anything was added
         if added:
             self.db.commit()
+            self._cache_thumbnails(added)
+        metrics.inc('videos_added_total', len(added))
+        metrics.set('last_sync_timestamp_seconds', time.time())
 
         # Return the list of added videos
         return added
 
     def _get_video_posts(self, session, pbar, count, posts, posts_url):
         """Recursively retrieves video posts from the API."""
-        res = session.get(posts_url, params={
-            'include': 'campaign',
-            'fields[campaign]': 'name,url',
-            'fields[post]': 'content,current_user_can_view,embed,image,'
-                            'is_paid,meta_image_url,post_file,'
-                            'post_metadata,published_at,patreon_url,'
-                            'post_type,thumbnail_url,title,url,'
-                            'was_posted_by_campaign_owner',
+        res = self._api_get(session, posts_url, params={
+            'fields[post]': ','.join(self.scan_fields),
             'filter[campaign_id]': '90486',
             'filter[contains_exclusive_posts]': 'true',
             'filter[is_draft]': 'false',
             'sort': '-published_at'
         })
+        res.raise_for_status()
         res_json = res.json()
+        self.manager.metrics.inc('pages_fetched_total')
 
         # Parse posts results
         for post in res_json['data']:
@@ -101,7 +154,7 @@ class VideoContent(PatreonContent):
                     post['attributes']['post_type'] == 'video_embed' and
                     post['attributes']['embed']['provider'] == 'Vimeo'
             ):
-                posts.append(post['attributes'])
+                posts.append(dict(post['attributes'], id=post['id']))
                 pbar.update(1)
 
                 # Check if we have reached the limit
@@ -114,46 +167,205 @@ class VideoContent(PatreonContent):
         # Recurse to get more posts
         return self._get_video_posts(session, pbar, count, posts, next_url)
 
+    def _get_post(self, session, post_id, fields):
+        """Retrieves selected fields of a single post from the API."""
+        res = self._api_get(session, f'{self.posts_url}/{post_id}', params={
+            'fields[post]': ','.join(fields)
+        })
+        res.raise_for_status()
+        return res.json()['data']
+
+    def _get_post_details(self, session, post_id):
+        """Retrieves the fields only needed to create a new video."""
+        post = self._get_post(session, post_id, self.detail_fields)
+        return post['attributes']
+
+    def _published_times(self):
+        """Get when each known video was published, for scheduling."""
+        rows = self.db.query(self.model.date, self.model.published_at).all()
+        return [published_at or datetime.combine(date, datetime.min.time())
+                for date, published_at in rows]
+
+    def _poll_videos(self, account, limit):
+        """Check for new videos, logging back in if the session expired."""
+        try:
+            return self._update_videos(account.session_id, limit)
+        except HTTPError as exc:
+            self.manager.error(f'Unable to check for new videos: {str(exc)}')
+            if exc.response.status_code not in (401, 403):
+                return None
+        except (RequestException, ValueError, KeyError) as exc:
+            # Network and API hiccups are retried at the next poll
+            self.manager.error(f'Unable to check for new videos: {str(exc)}')
+            return None
+
+        # Refresh the session so the next poll can succeed
+        try:
+            self.login_user()
+        except RequestException as exc:
+            self.manager.error(f'Unable to login: {str(exc)}')
+        return None
+
+    @property
+    def _transferred(self):
+        """Human readable size of the data received from the API."""
+        return tqdm.format_sizeof(self.bytes_transferred, 'B', 1024)
+
+    @staticmethod
+    def _thumbnail_url(video):
+        """Pick the best available thumbnail image for a video."""
+        return video.thumbnail_url or video.image_url or video.meta_image_url
+
+    def _cache_thumbnails(self, videos):
+        """Fetch thumbnail images for videos into the local cache."""
+        urls = [self._thumbnail_url(video) for video in videos]
+        with yaspin(Spinners.line, text='Caching thumbnails'):
+            self.thumbnails.fetch_many([url for url in urls if url])
+
     def _find_video(self, title, url):
         """Searches for a video in the database by title and URL."""
         return self.db.query(self.model)\
             .filter_by(title=title, url=url)\
             .one_or_none()
 
-    def _create_video(self, post):
-        """Creates a new video entry in the database."""
-        video_title = post['title']
-        video_url = post['url']
-
-        # Exit if the video already exists
-        if self._find_video(video_title, video_url):
-            return None
-
+    @staticmethod
+    def _parse_post(post):
+        """Derive video column values from raw post attributes."""
         # Parse vimeo URL
         parsed_url = urlparse(post['embed']['url'])
         vimeo_url = os.path.dirname(parsed_url.geturl()) \
             if os.path.dirname(parsed_url.path) != '/' else parsed_url.geturl()
 
         # Get video date
-        video_date = parser.parse(post['published_at']).date()
+        published_at = parser.parse(post['published_at'])
+        video_date = published_at.date()
+        if published_at.tzinfo:
+            published_at = published_at.astimezone(timezone.utc)
 
         # Get the video description
-        video_desc = post['content']
+        video_desc = post.get('content') or ''
         if video_desc != '':
             html = PyQuery(video_desc)
             video_desc = '\n\n'.join([p.text or '' for p in html('p')])
 
+        # Get the video images
+        image = post.get('image') or {}
+
+        # Return the derived values
+        return {
+            'title': post['title'],
+            'description': video_desc,
+            'date': video_date,
+            'published_at': published_at.replace(tzinfo=None),
+            'url': post['url'],
+            'video': vimeo_url,
+            'thumbnail_url': post.get('thumbnail_url'),
+            'image_url': image.get('large_url') or image.get('url'),
+            'meta_image_url': post.get('meta_image_url')
+        }
+
+    def _create_video(self, post):
+        """Creates a new video entry in the database."""
+        # Exit if the video already exists
+        if self._find_video(post['title'], post['url']):
+            return None
+
         # Return the new video object
-        return self.model(
-            title=video_title,
-            description=video_desc,
-            date=video_date,
-            url=video_url,
-            video=vimeo_url
-        )
+        return self.model(**self._parse_post(post))
+
+    @staticmethod
+    def _post_id(video):
+        """Get the Patreon post ID from the end of a video's post URL."""
+        match = re.search(r'(\d+)/?$', urlparse(video.url).path)
+        return match.group(1) if match else None
+
+    def _backfill_archive(self, session_id):
+        """Fetch and archive raw posts for videos added before archiving."""
+        session = self.session(session_id)
+        videos = self.db.query(self.model) \
+            .outerjoin(self.archive,
+                       self.archive.video_id == self.model.video_id) \
+            .filter(self.archive.video_id.is_(None)) \
+            .order_by(self.model.video_id).all()
 
-    def _download_video(self, video, video_path, yes):
+        # Set up progress bar data
+        progress_bar = {
+            'total': len(videos),
+            'unit': 'videos',
+            'desc': 'Fetching missing posts',
+            'bar_format': '{l_bar}{bar}| {n_fmt}/{total_fmt} {unit}'
+        }
+
+        # Fetch every field the parser uses, committing in batches
+        fields = self.scan_fields + self.detail_fields
+        fetched = 0
+        with tqdm(**progress_bar) as pbar:
+            for video in videos:
+                post_id = self._post_id(video)
+                try:
+                    if not post_id:
+                        raise ValueError(f'No post ID in URL: {video.url}')
+                    post = self._get_post(session, post_id, fields)
+                except (RequestException, ValueError, KeyError) as exc:
+                    tqdm.write(f'[ERROR] [{video.video_id}] {str(exc)}')
+                else:
+                    self.db.add(self.archive(
+                        video_id=video.video_id,
+                        post_id=post['id'],
+                        encoding=archive.DEFAULT_ENCODING,
+                        data=archive.compress(
+                            dict(post['attributes'], id=post['id']))
+                    ))
+                    fetched += 1
+                    if not fetched % self.reparse_batch_size:
+                        self.db.commit()
+                pbar.update(1)
+        self.db.commit()
+
+        # Return the number of posts added to the archive
+        return fetched
+
+    def _reparse_videos(self):
+        """Rebuild derived video columns from the raw post archive."""
+        total = self.db.query(self.archive).count()
+
+        # Set up progress bar data
+        progress_bar = {
+            'total': total,
+            'unit': 'videos',
+            'desc': 'Reparsing videos',
+            'bar_format': '{l_bar}{bar}| {n_fmt}/{total_fmt} {unit}'
+        }
+
+        # Walk the archive in ID order, one batch per transaction
+        changed = 0
+        last_id = 0
+        with tqdm(**progress_bar) as pbar:
+            while True:
+                rows = self.db.query(self.archive, self.model) \
+                    .join(self.model,
+                          self.model.video_id == self.archive.video_id) \
+                    .filter(self.archive.video_id > last_id) \
+                    .order_by(self.archive.video_id) \
+                    .limit(self.reparse_batch_size).all()
+                if not rows:
+                    break
+                for raw, video in rows:
+                    post = archive.decompress(raw.data, raw.encoding)
+                    for column, value in self._parse_post(post).items():
+                        if getattr(video, column) != value:
+                            setattr(video, column, value)
+                            changed += 1
+                self.db.commit()
+                last_id = rows[-1][0].video_id
+                pbar.update(len(rows))
+
+        # Return the number of column values that changed
+        return changed
+
+    def _download_video(self, video, video_path, yes, connections=1):
         """Downloads a video file to the specified path."""
+        self.manager.rate_limiter.acquire('vimeo')
         vimeo = Vimeo(video.video, embedded_on=video.url)
 
         # Select the best quality stream
@@ -170,11 +382,253 @@ class VideoContent(PatreonContent):
             return
 
         # Perform the download
-        stream.download(download_directory=video_path)
+        download = self._download_stream(
+            stream, file_path, file_name, connections)
 
         # Check that the file was downloaded
         if not os.path.isfile(file_path):
             self.manager.error(f'Problem downloading file: {file_path}')
+            return
+
+        # Record where the file lives and its checksum
+        video.file_path = os.path.abspath(file_path)
+        video.file_size = os.path.getsize(file_path)
+        video.checksum = download.checksum
+        self.db.commit()
+        return video
+
+    def _download_stream(self, stream, file_path, file_name, connections):
+        """Downloads a video stream, hashing it as it is written."""
+        session = Session()
+        session.headers = self.headers
+        download = SegmentedDownload(
+            session, stream.direct_url, file_path, connections)
+
+        # Set up progress bar data
+        progress_bar = {
+            'desc': file_name,
+            'unit': 'B',
+            'unit_scale': True,
+            'unit_divisor': 1024
+        }
+
+        # Fetch all segments into the file
+        metrics = self.manager.metrics
+        try:
+            with metrics.timer('download_seconds'), \
+                    tqdm(**progress_bar) as pbar:
+                size = download.run(pbar)
+        except (RequestException, DownloadError):
+            metrics.inc('downloads_total', result='failure')
+            raise
+        metrics.inc('downloads_total', result='success')
+        metrics.inc('download_bytes_total', size)
+        return download
+
+    def _pending_steps(self, video, steps):
+        """Get the processing steps whose outputs are missing or stale."""
+        done = {output.profile: output for output in
+                self.db.query(self.outputs).filter_by(video_id=video.video_id)}
+        pending = []
+        for step in steps:
+            output = done.get(step)
+            if output and os.path.isfile(output.file_path):
+                # Faststart rewrites the source, other steps derive from it
+                current = output.checksum if step == postprocess.FASTSTART \
+                    else output.source_checksum
+                if current == video.checksum:
+                    continue
+            pending.append(step)
+        # Later steps must be rebuilt from a freshly remuxed source
+        if postprocess.FASTSTART in pending:
+            return steps
+        return pending
+
+    def _record_outputs(self, video, results):
+        """Store processed outputs and any change to the source file."""
+        for profile, file_path, checksum, source in results:
+            output = self.db.query(self.outputs).get((video.video_id, profile))
+            if not output:
+                output = self.outputs(video_id=video.video_id, profile=profile)
+                self.db.add(output)
+            output.file_path = file_path
+            output.file_size = os.path.getsize(file_path)
+            output.checksum = checksum
+            output.source_checksum = source
+            # A faststart remux replaces the original file
+            if profile == postprocess.FASTSTART:
+                video.checksum = checksum
+                video.file_size = output.file_size
+        self.db.commit()
+
+    def _process_videos(self, videos, steps, workers):
+        """Run post-processing steps for videos on a process pool."""
+        ffmpeg = postprocess.find_ffmpeg()
+        if not ffmpeg:
+            self.manager.error('Unable to find ffmpeg on the PATH.')
+            return 0
+
+        # Split cores between workers so ffmpeg does not oversubscribe
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        jobs = {}
+        for video in videos:
+            pending = self._pending_steps(video, steps)
+            if pending and os.path.isfile(video.file_path):
+                jobs[video.video_id] = video, {
+                    'video_id': video.video_id,
+                    'file_path': video.file_path,
+                    'checksum': video.checksum,
+                    'steps': pending,
+                    'ffmpeg': ffmpeg,
+                    'threads': threads
+                }
+        if not jobs:
+            return 0
+
+        # Set up progress bar data
+        progress_bar = {
+            'total': len(jobs),
+            'unit': 'videos',
+            'desc': 'Processing videos',
+            'bar_format': '{l_bar}{bar}| {n_fmt}/{total_fmt} {unit}'
+        }
+
+        # Outputs are recorded from the main process as jobs finish
+        with tqdm(**progress_bar) as pbar:
+            with ProcessPoolExecutor(workers) as pool:
+                futures = {pool.submit(postprocess.process_video, job):
+                           video_id for video_id, (_, job) in jobs.items()}
+                for future in as_completed(futures):
+                    # A crashed worker must not lose the rest of the batch
+                    try:
+                        video_id, results, error = future.result()
+                    except Exception as exc:
+                        video_id, results = futures[future], []
+                        error = str(exc) or exc.__class__.__name__
+                    self._record_outputs(jobs[video_id][0], results)
+                    if error:
+                        tqdm.write(f'[ERROR] [{video_id}] {error}')
+                    pbar.update(1)
+        return len(jobs)
+
+    def _scan_library(self, root, workers, fix=False):
+        """Match files in the download directory to catalog entries."""
+        root = os.path.abspath(root)
+        scanner = DirectoryScanner(self.manager, self.db, workers)
+        with yaspin(Spinners.line, text='Scanning download directory'):
+            files = scanner.walk(root)
+
+        # Proxy copies are known files, not orphans; a faststart output is
+        # the video's own file, so it must still match by stored path
+        outputs = {output.file_path for output in self.db.query(self.outputs)
+                   .filter(self.outputs.profile != postprocess.FASTSTART)}
+        unmatched = {path: size for path, size in files.items()
+                     if path not in outputs}
+        prefix = os.path.join(root, '')
+        report = {'found': [], 'changed': [], 'renamed': [], 'title': []}
+
+        # First match files by their stored path and size
+        remaining = []
+        for video in self.db.query(self.model).order_by(self.model.video_id):
+            if video.file_path in unmatched:
+                size = unmatched.pop(video.file_path)
+                status = 'found' if video.file_size in (None, size) \
+                    else 'changed'
+                report[status].append((video, video.file_path))
+            elif video.file_path and not video.file_path.startswith(prefix) \
+                    and os.path.isfile(video.file_path):
+                # Stored outside the scanned folder and still there
+                continue
+            else:
+                remaining.append(video)
+
+        # Then look for renamed files by size, confirming with the checksum
+        by_size = {}
+        for video in remaining:
+            if video.file_size and video.checksum:
+                by_size.setdefault(video.file_size, []).append(video)
+        candidates = [(path, video) for path, size in unmatched.items()
+                      for video in by_size.get(size, [])]
+
+        def check(candidate):
+            path, video = candidate
+            algorithm, _ = parse_checksum(video.checksum)
+            try:
+                return hash_file(path, algorithm) == video.checksum
+            except (OSError, ValueError):
+                return False
+
+        with ThreadPoolExecutor(workers) as pool:
+            matches = list(pool.map(check, candidates))
+        for (path, video), match in zip(candidates, matches):
+            if match and path in unmatched and video in remaining:
+                unmatched.pop(path)
+                remaining.remove(video)
+                report['renamed'].append((video, path))
+
+        # Finally fall back to fuzzy matching file names against titles
+        titles = {video.title.lower(): video for video in remaining}
+        for path in sorted(unmatched):
+            stem = os.path.splitext(os.path.basename(path))[0].lower()
+            close = get_close_matches(stem, titles, n=1, cutoff=0.8)
+            if close:
+                video = titles.pop(close[0])
+                unmatched.pop(path)
+                remaining.remove(video)
+                report['title'].append((video, path))
+
+        # Anything left is either missing from disk or orphaned
+        report['missing'] = [(video, video.file_path) for video in remaining
+                             if video.file_path]
+        report['orphaned'] = [(None, path) for path in sorted(unmatched)]
+
+        # Record the new locations of matched files
+        if fix:
+            for video, path in report['renamed']:
+                video.file_path = path
+            for video, path in report['title']:
+                video.file_path = path
+                video.file_size = os.path.getsize(path)
+                video.checksum = hash_file(path)
+            self.db.commit()
+
+        # Return the report and how many directories were read
+        return report, scanner.rescanned
+
+    def _verify_videos(self, videos, workers):
+        """Re-hash downloaded videos and collect any problems."""
+        def check(video):
+            if not os.path.isfile(video.file_path):
+                return video, 'missing'
+            algorithm, _ = parse_checksum(video.checksum)
+            try:
+                if hash_file(video.file_path, algorithm) != video.checksum:
+                    return video, 'mismatch'
+            except (OSError, ValueError) as exc:
+                return video, f'unreadable: {str(exc)}'
+            return video, None
+
+        # Set up progress bar data
+        progress_bar = {
+            'total': len(videos),
+            'unit': 'videos',
+            'desc': 'Verifying videos',
+            'bar_format': '{l_bar}{bar}| {n_fmt}/{total_fmt} {unit}'
+        }
+
+        # Hash files concurrently since hashing releases the GIL
+        problems = []
+        with tqdm(**progress_bar) as pbar:
+            with ThreadPoolExecutor(workers) as pool:
+                futures = [pool.submit(check, video) for video in videos]
+                for future in as_completed(futures):
+                    video, problem = future.result()
+                    if problem:
+                        problems.append((video, problem))
+                    pbar.update(1)
+
+        # Return problems sorted by video ID
+        return sorted(problems, key=lambda p: p[0].video_id)
 
     @staticmethod
     def table(metadata):
@@ -186,10 +640,19 @@ class VideoContent(PatreonContent):
             Column('title', String, nullable=False),
             Column('description', String, nullable=True),
             Column('date', Date, nullable=False),
+            Column('published_at', DateTime, nullable=True),
             Column('url', URLType, nullable=False),
             Column('video', URLType, nullable=False),
+            Column('file_path', String, nullable=True),
+            Column('file_size', BigInteger, nullable=True),
+            Column('checksum', String, nullable=True),
+            Column('thumbnail_url', URLType, nullable=True),
+            Column('image_url', URLType, nullable=True),
+            Column('meta_image_url', URLType, nullable=True),
             Column('last_updated', DateTime, server_default=func.now(),
                    onupdate=func.now(), nullable=False),
+            # Lets listings page through the catalog by keyset
+            Index('ix_videos_date_video_id', 'date', 'video_id')
         )
 
     @staticmethod
@@ -204,6 +667,54 @@ class VideoContent(PatreonContent):
         ] for video in videos]
         return tabulate(table_data, fields, tablefmt=fmt)
 
+    def video_data(self, video):
+        """Machine-readable details for a video."""
+        return {
+            'id': video.video_id,
+            'date': video.date.isoformat(),
+            'title': video.title,
+            'description': video.description,
+            'url': video.url,
+            'video': video.video,
+            'thumbnail_url': self._thumbnail_url(video)
+        }
+
+    def find_videos(self, number=10, search=None, since=None, until=None,
+                    after_id=None, oldest=False, downloaded=False):
+        """Get a page of videos and the cursor for the next page."""
+        date, video_id = self.model.date, self.model.video_id
+        order = [date.asc(), video_id.asc()] if oldest \
+            else [date.desc(), video_id.desc()]
+        query = self.db.query(self.model).order_by(*order)
+
+        # Handle filters
+        if search:
+            query = query.filter(self.model.title.like(f'%{search}%'))
+        if since:
+            query = query.filter(date >= since)
+        if until:
+            query = query.filter(date <= until)
+        if downloaded:
+            query = query.filter(self.model.file_path.isnot(None))
+
+        # Continue after the cursor row using the (date, ID) index
+        if after_id is not None:
+            cursor = self.db.query(self.model).get(after_id)
+            if not cursor:
+                raise ValueError(f'No video found for cursor: {after_id}')
+            # A row-value comparison lets SQLite seek instead of scanning
+            key = tuple_(date, video_id)
+            after = (cursor.date, cursor.video_id)
+            query = query.filter(key > after if oldest else key < after)
+
+        # Fetch one extra row to tell whether there is another page
+        if number <= 0:
+            return query.all(), None
+        videos = query.limit(number + 1).all()
+        if len(videos) > number:
+            return videos[:number], videos[number - 1].video_id
+        return videos, None
+
     def get_video(self, video_id):
         """Get video in database by ID."""
         video = self.db.query(self.model).get(video_id)
@@ -224,6 +735,7 @@ class VideoContent(PatreonContent):
         def fn(account, number, list_):
             """Updates the the list of videos."""
             new_videos = self._update_videos(account.session_id, number)
+            self.manager.info(f'Transferred {self._transferred} from API.')
             # Check for results
             if not new_videos:
                 self.manager.info('No new videos found.')
@@ -234,6 +746,170 @@ class VideoContent(PatreonContent):
                 click.echo(self.format_video_list(new_videos))
         return fn
 
+    @property
+    def reparse(self):
+        """Command to rebuild video details from archived posts."""
+        @click.command(help='Rebuild video details from archived posts.')
+        @click.option('-f', '--fetch-missing', is_flag=True,
+                      help='First archive posts for videos that have none.')
+        def fn(fetch_missing):
+            """Rebuild video details from archived posts."""
+            if fetch_missing:
+                with yaspin(spinner=Spinners.line):
+                    account = self.login_user()
+                if not account:
+                    return
+                fetched = self._backfill_archive(account.session_id)
+                self.manager.info(f'Archived {fetched} missing post(s).')
+            changed = self._reparse_videos()
+            self.manager.success(f'Updated {changed} video detail(s)!')
+        return fn
+
+    @property
+    def scan(self):
+        """Command to reconcile the catalog with the download directory."""
+        @click.command(help='Match downloaded files to videos.')
+        @click.option('-d', '--dest', type=click.Path(exists=True),
+                      help='Folder to scan instead of the download folder.')
+        @click.option('-w', '--workers', default=8, show_default=True,
+                      type=click.IntRange(1, 64),
+                      help='Number of directories to read at once.')
+        @click.option('--fix', is_flag=True,
+                      help='Record the new location of renamed files.')
+        @click.option('-a', '--all', 'all_', is_flag=True,
+                      help='Also list files that are where they should be.')
+        @self.auto_login_user(with_account=True)
+        def fn(account, dest, workers, fix, all_):
+            """Match downloaded files to videos."""
+            root = self._get_download_dir(dest, account)
+            report, rescanned = self._scan_library(root, workers, fix)
+            statuses = [s for s in report if all_ or s != 'found']
+            table_data = [[
+                status,
+                video.video_id if video else '',
+                shorten(video.title, width=40) if video else '',
+                path
+            ] for status in statuses for video, path in report[status]]
+            if table_data:
+                click.echo(tabulate(table_data,
+                                    ['Status', 'ID', 'Title', 'Path'],
+                                    tablefmt='psql'))
+            self.manager.info(', '.join(
+                f'{len(items)} {status}' for status, items in report.items()
+            ) + f' ({rescanned} folder(s) read)')
+        return fn
+
+    @property
+    def process(self):
+        """Command to post-process downloaded videos."""
+        @click.command(help='Remux or transcode downloaded videos.')
+        @click.option('-p', '--profile', 'profiles', multiple=True,
+                      type=click.Choice(postprocess.PROFILES),
+                      help='Also transcode to this profile.')
+        @click.option('--no-faststart', is_flag=True,
+                      help='Skip moving the index to the front of files.')
+        @click.option('-w', '--workers', default=os.cpu_count() or 1,
+                      show_default=True, type=click.IntRange(1, 64),
+                      help='Number of videos to process at once.')
+        @click.argument('video_ids', nargs=-1)
+        @self.auto_login_user()
+        def fn(profiles, no_faststart, workers, video_ids):
+            """Remux or transcode downloaded videos."""
+            steps = ([] if no_faststart else [postprocess.FASTSTART]) + \
+                list(profiles)
+            if not steps:
+                click.echo(click.get_current_context().get_help())
+                return
+            query = self.db.query(self.model) \
+                .filter(self.model.file_path.isnot(None))
+            if video_ids:
+                query = query.filter(self.model.video_id.in_(video_ids))
+            count = self._process_videos(query.all(), steps, workers)
+            if count:
+                self.manager.success(f'Processed {count} video(s)!')
+            else:
+                self.manager.info('No videos need processing.')
+        return fn
+
+    @property
+    def serve(self):
+        """Command to serve the downloaded video library over HTTP."""
+        @click.command(help='Stream downloaded videos over HTTP.')
+        @click.option('-H', '--host', default='127.0.0.1', show_default=True,
+                      help='Address to listen on.')
+        @click.option('-p', '--port', default=8080, show_default=True,
+                      type=click.IntRange(1, 65535),
+                      help='Port to listen on.')
+        def fn(host, port):
+            """Stream downloaded videos over HTTP."""
+            server = LibraryServer((host, port), self)
+            self.manager.success(f'Serving video library on {host}:{port}')
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                self.manager.info('Stopped serving video library.')
+            finally:
+                server.server_close()
+        return fn
+
+    @property
+    def watch(self):
+        """Command to keep polling for new videos."""
+        @click.command(help='Keep checking for new videos.')
+        @click.option('-n', '--number', default=10, show_default=True,
+                      help='Number of videos to scan on each check.')
+        @click.option('--min-interval', default=10, show_default=True,
+                      type=click.IntRange(1),
+                      help='Shortest time between checks, in minutes.')
+        @click.option('--max-interval', default=360, show_default=True,
+                      type=click.IntRange(1),
+                      help='Longest time between checks, in minutes.')
+        @click.option('-D', '--download', 'download_', is_flag=True,
+                      help='Download new videos as they are found.')
+        @click.option('-d', '--dest', type=click.Path(exists=True),
+                      help='Folder to download files to.')
+        @click.option('-c', '--connections', default=1, show_default=True,
+                      type=click.IntRange(1, 16),
+                      help='Number of concurrent connections to use.')
+        @click.option('--metrics-port', type=click.IntRange(1, 65535),
+                      help='Serve Prometheus metrics on this port.')
+        @self.auto_login_user(with_account=True)
+        def fn(account, number, min_interval, max_interval, download_, dest,
+               connections, metrics_port):
+            """Keep checking for new videos."""
+            if min_interval > max_interval:
+                self.manager.error('Minimum interval exceeds the maximum.')
+                return
+            if metrics_port:
+                self.manager.metrics.serve(metrics_port)
+            scheduler = PollScheduler(self._published_times(),
+                                      min_interval * 60, max_interval * 60)
+            video_path = self._get_download_dir(dest, account)
+            try:
+                while True:
+                    new_videos = self._poll_videos(account, number)
+                    scheduler.record(bool(new_videos))
+                    self.manager.write_metrics()
+                    # Report and optionally download new videos
+                    for video in new_videos or []:
+                        self.manager.success(
+                            f'New video [{video.video_id}]: {video.title}')
+                        if download_:
+                            try:
+                                self._download_video(
+                                    video, video_path, True, connections)
+                            except (RequestError, RequestException,
+                                    DownloadError) as exc:
+                                self.manager.error(str(exc))
+                    # Wait until the next check is due
+                    delay = scheduler.next_delay()
+                    self.manager.info(
+                        f'Next check in {delay / 60:.0f} minute(s).')
+                    time.sleep(delay)
+            except KeyboardInterrupt:
+                self.manager.info('Stopped watching for new videos.')
+        return fn
+
     @property
     def download(self):
         """Command to download a given video."""
@@ -242,17 +918,54 @@ class VideoContent(PatreonContent):
                       help='Download without confirmation.')
         @click.option('-d', '--dest', type=click.Path(exists=True),
                       help='Folder to download file to.')
+        @click.option('-c', '--connections', default=1, show_default=True,
+                      type=click.IntRange(1, 16),
+                      help='Number of concurrent connections to use.')
+        @click.option('-p', '--process', 'process_', is_flag=True,
+                      help='Remux the file for streaming once downloaded.')
         @click.argument('video_id')
         @self.auto_login_user(with_account=True)
-        def fn(video_id, yes, dest, account):
+        def fn(video_id, yes, dest, connections, process_, account):
             """Download a video by ID."""
             video_path = self._get_download_dir(dest, account)
             video = self.get_video(video_id)
             if video:
                 try:
-                    self._download_video(video, video_path, yes)
-                except RequestError as exc:
+                    video = self._download_video(
+                        video, video_path, yes, connections)
+                except (RequestError, RequestException, DownloadError) as exc:
                     self.manager.error(str(exc))
+                    return
+                if video and process_:
+                    self._process_videos([video], [postprocess.FASTSTART], 1)
+        return fn
+
+    @property
+    def verify(self):
+        """Command to check downloaded videos against their checksums."""
+        @click.command(help='Verify the integrity of downloaded videos.')
+        @click.option('-w', '--workers', default=os.cpu_count() or 4,
+                      show_default=True, type=click.IntRange(1, 64),
+                      help='Number of files to hash at once.')
+        @click.argument('video_ids', nargs=-1)
+        @self.auto_login_user()
+        def fn(workers, video_ids):
+            """Verify the integrity of downloaded videos."""
+            query = self.db.query(self.model) \
+                .filter(self.model.checksum.isnot(None))
+            if video_ids:
+                query = query.filter(self.model.video_id.in_(video_ids))
+            videos = query.all()
+            if not videos:
+                self.manager.warning('No downloaded videos found.')
+                return
+            # Report any problems found
+            problems = self._verify_videos(videos, workers)
+            for video, problem in problems:
+                self.manager.error(
+                    f'[{video.video_id}] {video.file_path}: {problem}')
+            if not problems:
+                self.manager.success(f'Verified {len(videos)} video(s)!')
         return fn
 
     @property
@@ -276,11 +989,38 @@ class VideoContent(PatreonContent):
                     form.format('Title', video.title),
                     form.format('Description', description),
                     form.format('Video', video.video),
-                    form.format('URL', video.url)
+                    form.format('URL', video.url),
+                    form.format('Thumbnail', self._thumbnail_url(video))
                 ])
                 click.echo(video_data)
         return fn
 
+    @property
+    def thumbnail(self):
+        """Command to get the cached thumbnail image for a video."""
+        @click.command(help='Get the thumbnail image for a video.')
+        @click.option('-o', '--open', 'open_', is_flag=True,
+                      help='Open the image in the default viewer.')
+        @click.argument('video_id')
+        @self.auto_login_user()
+        def fn(video_id, open_):
+            """Get the thumbnail image for a video."""
+            video = self.get_video(video_id)
+            if not video:
+                return
+            url = self._thumbnail_url(video)
+            if not url:
+                self.manager.warning('No thumbnail found for video.')
+                return
+            file_path = self.thumbnails.get(url)
+            if not file_path:
+                self.manager.error(f'Unable to fetch thumbnail: {url}')
+                return
+            click.echo(file_path)
+            if open_:
+                click.launch(file_path)
+        return fn
+
     @property
     def open(self):
         """Command to open video link in a browser."""
@@ -308,25 +1048,42 @@ class VideoContent(PatreonContent):
                       show_default=True, help='How to format the list.')
         @click.option('-s', '--search',
                       help='Search videos by title.')
+        @click.option('--since', type=click.DateTime(['%Y-%m-%d']),
+                      help='Only show videos on or after this date.')
+        @click.option('--until', type=click.DateTime(['%Y-%m-%d']),
+                      help='Only show videos on or before this date.')
+        @click.option('--after-id', type=int,
+                      help='Show the page after this video ID cursor.')
+        @click.option('--sort', default='newest', show_default=True,
+                      type=click.Choice(['newest', 'oldest']),
+                      help='Order to list videos in.')
+        @click.option('--json', 'json_', is_flag=True,
+                      help='Output the page and next cursor as JSON.')
         @self.auto_login_user(with_account=True)
-        def fn(account, number, refresh, fmt, search=None):
+        def fn(account, number, refresh, fmt, since, until, after_id, sort,
+               json_, search=None):
             """Show all available videos."""
             if refresh:
                 self._update_videos(account.session_id)
-            # Set up query
-            query = self.db.query(self.model) \
-                .order_by(self.model.date.desc())
-            # Handle search query
-            if search:
-                query = query.filter(self.model.title.like(f'%{search}%'))
-            # Handle limit
-            if number > 0:
-                query = query.limit(number)
             # Run the query
-            videos = query.all()
+            try:
+                videos, next_id = self.find_videos(
+                    number, search, since and since.date(),
+                    until and until.date(), after_id, sort == 'oldest')
+            except ValueError as exc:
+                self.manager.error(str(exc))
+                return
+            if json_:
+                click.echo(json.dumps({
+                    'videos': [self.video_data(video) for video in videos],
+                    'next_cursor': next_id
+                }))
+                return
             if not videos:
                 self.manager.warning('No videos found.')
                 return
             # Display the list
             click.echo(self.format_video_list(videos, fmt=fmt))
+            if next_id is not None:
+                self.manager.info(f'Next page: --after-id {next_id}')
         return fn
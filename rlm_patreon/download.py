@@ -0,0 +1,232 @@
+"""
+Copyright (C) 2021 Erin Morelli.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see [https://www.gnu.org/licenses/].
+"""
+
+import os
+from threading import Event, Lock
+from concurrent.futures import ThreadPoolExecutor
+
+from requests import RequestException
+
+from rlm_patreon.checksum import new_hasher, format_checksum, BLOCK_SIZE
+
+
+class DownloadError(Exception):
+    """Raised when a file could not be downloaded completely."""
+
+
+class SegmentedDownload:
+    """Download a single file over multiple concurrent ranged requests."""
+    # Size of each chunk read from the response stream
+    chunk_size = 1024 * 1024
+    # Do not bother splitting files smaller than this
+    min_segment_size = 8 * 1024 * 1024
+    # Number of times a segment is retried before giving up
+    retries = 3
+    # Seconds to wait before the first retry, doubled for each one after
+    retry_delay = 1.0
+    # Ranges and lengths must refer to the stored bytes, so never encode
+    headers = {'Accept-Encoding': 'identity'}
+
+    def __init__(self, session, url, file_path, connections=4):
+        """Setup details for the download."""
+        self.session = session
+        self.url = url
+        self.file_path = file_path
+        self.part_path = f'{file_path}.part'
+        self.connections = max(1, connections)
+        self.checksum = None
+        self._lock = Lock()
+        self._pbar = None
+        # Incremental hash state, always fed in file order
+        self._hasher = new_hasher()
+        self._hashed = 0
+        self._hash_lock = Lock()
+        self._segments_done = []
+        self._segments_lock = Lock()
+        # Tells segment threads to stop after a failure or an interrupt
+        self._cancel = Event()
+
+    def _get_size(self):
+        """Get the remote file size and whether ranges are supported."""
+        res = self.session.get(self.url, headers=dict(
+            self.headers, Range='bytes=0-0'), stream=True)
+        res.close()
+        res.raise_for_status()
+
+        # A partial response means the server honours byte ranges
+        if res.status_code == 206:
+            content_range = res.headers.get('Content-Range', '')
+            total = content_range.rpartition('/')[2]
+            if total.isdigit():
+                return int(total), True
+
+        # Fall back to the full content length
+        length = res.headers.get('Content-Length')
+        return (int(length) if length else None), False
+
+    def _segments(self, size):
+        """Split the file into byte ranges, one per connection."""
+        count = min(self.connections, max(1, size // self.min_segment_size))
+        step = -(-size // count)
+        return [(start, min(start + step, size) - 1)
+                for start in range(0, size, step)]
+
+    def _update(self, amount):
+        """Advance the shared progress bar."""
+        if self._pbar is not None:
+            with self._lock:
+                self._pbar.update(amount)
+
+    def _frontier(self, segments):
+        """Offset up to which the file has been written contiguously."""
+        for (start, end), offset in zip(segments, self._segments_done):
+            if offset <= end:
+                return offset
+        return segments[-1][1] + 1
+
+    def _advance_hash(self, fd, segments, offset=None, chunk=None):
+        """Hash the file up to the contiguous frontier, if nobody else is."""
+        # Whoever holds the hash lock catches up for everyone, so other
+        # connections keep downloading instead of waiting on the reads
+        if not self._hash_lock.acquire(blocking=False):
+            return
+        try:
+            # Hash straight from memory when this chunk is next in line
+            if offset == self._hashed:
+                self._hasher.update(chunk)
+                self._hashed += len(chunk)
+            # Read back later segments that are already on disk
+            while True:
+                with self._segments_lock:
+                    frontier = self._frontier(segments)
+                if self._hashed >= frontier:
+                    return
+                size = min(BLOCK_SIZE, frontier - self._hashed)
+                data = os.pread(fd, size, self._hashed)
+                self._hasher.update(data)
+                self._hashed += len(data)
+        finally:
+            self._hash_lock.release()
+
+    def _hash_chunk(self, fd, segments, index, offset, chunk):
+        """Record a written chunk and advance the running hash."""
+        with self._segments_lock:
+            self._segments_done[index] = offset + len(chunk)
+        self._advance_hash(fd, segments, offset, chunk)
+
+    def _fetch_segment(self, fd, segments, index):
+        """Fetch one byte range and write it in place."""
+        start, end = segments[index]
+        offset = start
+        attempts = 0
+
+        while offset <= end and not self._cancel.is_set():
+            try:
+                headers = dict(self.headers, Range=f'bytes={offset}-{end}')
+                with self.session.get(self.url, headers=headers,
+                                      stream=True, timeout=30) as res:
+                    res.raise_for_status()
+                    if res.status_code != 206:
+                        raise DownloadError(
+                            f'Server ignored range request for {self.url}')
+                    for chunk in res.iter_content(self.chunk_size):
+                        if self._cancel.is_set():
+                            break
+                        # Never write past the end of this segment
+                        chunk = chunk[:end - offset + 1]
+                        os.pwrite(fd, chunk, offset)
+                        self._hash_chunk(fd, segments, index, offset, chunk)
+                        offset += len(chunk)
+                        self._update(len(chunk))
+                        if offset > end:
+                            break
+                error = 'connection closed early'
+            except RequestException as exc:
+                error = str(exc)
+            # Retry from the last written offset if the segment is short
+            if offset <= end and not self._cancel.is_set():
+                attempts += 1
+                if attempts > self.retries:
+                    raise DownloadError(
+                        f'Segment {start}-{end} failed: {error}')
+                # Back off before retrying, unless the download was cancelled
+                self._cancel.wait(self.retry_delay * 2 ** (attempts - 1))
+
+        # Return the number of bytes written for verification
+        return offset - start
+
+    def _fetch_single(self, fd):
+        """Fetch the whole file over one connection."""
+        written = 0
+        with self.session.get(self.url, headers=self.headers, stream=True,
+                              timeout=30) as res:
+            res.raise_for_status()
+            for chunk in res.iter_content(self.chunk_size):
+                os.pwrite(fd, chunk, written)
+                self._hasher.update(chunk)
+                written += len(chunk)
+                self._update(len(chunk))
+        return written
+
+    def run(self, pbar=None):
+        """Perform the download and move the file into place."""
+        self._pbar = pbar
+        self._hasher = new_hasher()
+        self._hashed = 0
+        self._cancel.clear()
+        size, ranged = self._get_size()
+        if pbar is not None and size:
+            pbar.reset(total=size)
+
+        fd = os.open(self.part_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC,
+                     0o644)
+        try:
+            if ranged and size:
+                # Preallocate a sparse file so segments can land anywhere
+                os.ftruncate(fd, size)
+                segments = self._segments(size)
+                self._segments_done = [start for start, _ in segments]
+                pool = ThreadPoolExecutor(len(segments))
+                try:
+                    written = sum(pool.map(
+                        lambda idx: self._fetch_segment(fd, segments, idx),
+                        range(len(segments))))
+                finally:
+                    # Stop the other connections if a segment failed or the
+                    # user interrupted, then wait so none writes after close
+                    self._cancel.set()
+                    pool.shutdown(wait=True, cancel_futures=True)
+                # Hash anything left while another thread held the hash lock
+                self._advance_hash(fd, segments)
+            else:
+                written = self._fetch_single(fd)
+            os.fsync(fd)
+        except BaseException:
+            # Never leave a partial file behind, even on Ctrl-C
+            os.close(fd)
+            os.remove(self.part_path)
+            raise
+        os.close(fd)
+
+        # Verify that every byte arrived before finalizing the file
+        if size is not None and written != size:
+            os.remove(self.part_path)
+            raise DownloadError(
+                f'Incomplete download: got {written} of {size} bytes')
+        os.replace(self.part_path, self.file_path)
+        self.checksum = format_checksum(self._hasher)
+        return written
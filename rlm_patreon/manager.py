@@ -22,10 +22,12 @@ import click
 from cryptography.fernet import Fernet
 
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import MetaData, create_engine
+from sqlalchemy import MetaData, create_engine, inspect, text
 from sqlalchemy.exc import InvalidRequestError
 from sqlalchemy.ext.automap import automap_base
 
+from rlm_patreon.metrics import Metrics
+from rlm_patreon.ratelimit import RateLimiter
 from rlm_patreon.content_types import get_content_types
 
 
@@ -40,6 +42,11 @@ class PatreonManager:
     __key_file = os.path.join(config_path, '.secret_key')
     # URI for the local sqlite database file
     db_uri = f'sqlite:///{config_path}/content.db'
+    # Separate sqlite file holding the shared rate limit buckets
+    rate_limit_path = os.path.join(config_path, 'ratelimits.db')
+    # Optional Prometheus textfile collector file to write metrics to
+    metrics_env_var = 'RLM_PM_METRICS_FILE'
+    metrics_file = os.environ.get(metrics_env_var, None)
     # CLI context settings
     context_settings = {
         'help_option_names': ['-h', '--help']
@@ -50,6 +57,8 @@ class PatreonManager:
         self._setup()
         # Encryption/decryption cipher handler
         self.__cipher = self.__get_cipher()
+        # Registry for activity metrics
+        self.metrics = Metrics()
         # List of all content type classes
         self._types = get_content_types()
         # Setup the engine for the sqlite database
@@ -63,6 +72,8 @@ class PatreonManager:
         self._base.prepare()
         # Setup a session generator for database connections
         self._session = sessionmaker(bind=self._engine)
+        # Request budgets shared with other processes on this machine
+        self.rate_limiter = RateLimiter(self.rate_limit_path)
 
     def _setup(self):
         """Make sure files and folders exist."""
@@ -90,14 +101,34 @@ class PatreonManager:
     def _load_db(self):
         """Dynamically loads database table schemas."""
         for type_ in self._types:
-            try:
-                type_.table(self._metadata)
-            except InvalidRequestError:
-                pass
+            for table in [type_.table] + type_.extra_tables:
+                try:
+                    table(self._metadata)
+                except InvalidRequestError:
+                    pass
         # Reflect metadata so auto-mapping works
         self._metadata.reflect(self._engine)
         # Make sure the tables exist
         self._metadata.create_all()
+        self._migrate_db()
+
+    def _migrate_db(self):
+        """Add any new nullable columns and indexes to existing tables."""
+        inspector = inspect(self._engine)
+        with self._engine.begin() as conn:
+            for table in self._metadata.sorted_tables:
+                columns = inspector.get_columns(table.name)
+                existing = {column['name'] for column in columns}
+                for column in table.columns:
+                    if column.name in existing or not column.nullable:
+                        continue
+                    col_type = column.type.compile(self._engine.dialect)
+                    conn.execute(text(
+                        f'ALTER TABLE {table.name} '
+                        f'ADD COLUMN {column.name} {col_type}'
+                    ))
+                for index in table.indexes:
+                    index.create(conn, checkfirst=True)
 
     def get_session(self):
         """Create a new database session using the session maker."""
@@ -108,6 +139,11 @@ class PatreonManager:
         """Object containing auto-mapped database model classes."""
         return self._base.classes
 
+    def write_metrics(self):
+        """Merge metrics into the textfile collector file, if configured."""
+        if self.metrics_file:
+            self.metrics.write_textfile(self.metrics_file)
+
     @staticmethod
     def success(msg):
         """Print success message in green text."""
@@ -132,9 +168,14 @@ class PatreonManager:
     def cli(self):
         """Base command group to load subcommands into."""
         @click.group(context_settings=self.context_settings)
-        def fn():
+        @click.pass_context
+        def fn(ctx):
             """Manage Patreon exclusive content."""
+            ctx.call_on_close(self.write_metrics)
         # Dynamically load commands from content type classes
         for type_ in self._types:
-            fn.add_command(type_(self).cli, type_.command)
+            content = type_(self)
+            fn.add_command(content.cli, type_.command)
+            for cmd in type_.root_commands:
+                fn.add_command(getattr(content, cmd), cmd)
         return fn
@@ -0,0 +1,238 @@
+"""
+Copyright (C) 2021 Erin Morelli.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see [https://www.gnu.org/licenses/].
+"""
+
+import os
+import re
+import time
+import fcntl
+from threading import Lock, Thread
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+# All exported metrics with their Prometheus type and help text
+METRICS = {
+    'api_requests_total': (
+        'counter', 'Patreon API requests made, by endpoint and status.'),
+    'api_request_seconds': (
+        'summary', 'Time spent waiting on Patreon API requests.'),
+    'api_response_bytes_total': (
+        'counter', 'Compressed response bytes received from the API.'),
+    'pages_fetched_total': (
+        'counter', 'Pages of posts fetched while scanning the archive.'),
+    'posts_scanned_total': (
+        'counter', 'Video posts scanned while updating the catalog.'),
+    'videos_added_total': (
+        'counter', 'New videos added to the catalog.'),
+    'sync_seconds': (
+        'summary', 'Time taken to update the catalog.'),
+    'last_sync_timestamp_seconds': (
+        'gauge', 'Unix time of the last successful catalog update.'),
+    'login_attempts_total': (
+        'counter', 'Browser login attempts, by result.'),
+    'downloads_total': (
+        'counter', 'Video downloads, by result.'),
+    'download_bytes_total': (
+        'counter', 'Video bytes downloaded.'),
+    'download_seconds': (
+        'summary', 'Time taken to download videos.')
+}
+
+
+class Metrics:
+    """Thread-safe registry of metrics in Prometheus text format."""
+    prefix = 'rlm_patreon'
+    # Sample lines as rendered below, with summaries split into sum/count
+    sample_pattern = re.compile(
+        r'^(\w+?)(?:_(sum|count))?(?:\{(.*)\})? (\S+)$')
+    label_pattern = re.compile(r'(\w+)="([^"]*)"')
+
+    def __init__(self):
+        """Setup details for the registry."""
+        self._lock = Lock()
+        self._values = {}
+        # Values already merged into the textfile by this process
+        self._written = {}
+
+    def _key(self, name, labels):
+        """Build a registry key from a metric name and its labels."""
+        if name not in METRICS:
+            raise KeyError(f'Unknown metric: {name}')
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name, amount=1, **labels):
+        """Increase a counter."""
+        key = self._key(name, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        """Set the value of a gauge."""
+        key = self._key(name, labels)
+        with self._lock:
+            self._values[key] = value
+
+    def observe(self, name, value, **labels):
+        """Add an observation to a summary."""
+        key = self._key(name, labels)
+        with self._lock:
+            total, count = self._values.get(key, (0, 0))
+            self._values[key] = (total + value, count + 1)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observe how long a block of code takes."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - start, **labels)
+
+    @staticmethod
+    def _format(name, labels, value):
+        """Format a single sample line."""
+        if labels:
+            pairs = ','.join(f'{k}="{v}"' for k, v in labels)
+            name = f'{name}{{{pairs}}}'
+        return f'{name} {value}'
+
+    def render(self, values=None):
+        """Render recorded metrics in the text exposition format."""
+        if values is None:
+            with self._lock:
+                values = dict(self._values)
+
+        lines = []
+        for name, (kind, help_) in METRICS.items():
+            samples = sorted((labels, value) for (metric, labels), value
+                             in values.items() if metric == name)
+            if not samples:
+                continue
+            full_name = f'{self.prefix}_{name}'
+            lines.append(f'# HELP {full_name} {help_}')
+            lines.append(f'# TYPE {full_name} {kind}')
+            for labels, value in samples:
+                if kind == 'summary':
+                    total, count = value
+                    lines.append(
+                        self._format(f'{full_name}_sum', labels, total))
+                    lines.append(
+                        self._format(f'{full_name}_count', labels, count))
+                else:
+                    lines.append(self._format(full_name, labels, value))
+        return '\n'.join(lines) + '\n'
+
+    def _parse(self, text):
+        """Read values back from a rendered textfile."""
+        values = {}
+        for line in text.splitlines():
+            match = self.sample_pattern.match(line)
+            if not match or not line.startswith(f'{self.prefix}_'):
+                continue
+            name, part, labels, value = match.groups()
+            name = name[len(self.prefix) + 1:]
+            if name not in METRICS:
+                continue
+            value = float(value)
+            value = int(value) if value.is_integer() else value
+            labels = tuple(sorted(self.label_pattern.findall(labels or '')))
+            if METRICS[name][0] == 'summary':
+                total, count = values.get((name, labels), (0, 0))
+                values[(name, labels)] = (value, count) if part == 'sum' \
+                    else (total, int(value))
+            elif not part:
+                values[(name, labels)] = value
+        return values
+
+    def _unwritten(self, values):
+        """Changes recorded since the last write to the textfile."""
+        changes = {}
+        for key, value in values.items():
+            kind = METRICS[key[0]][0]
+            written = self._written.get(key)
+            if kind == 'gauge':
+                if value != written:
+                    changes[key] = value
+            elif kind == 'summary':
+                total, count = written or (0, 0)
+                if value[1] != count:
+                    changes[key] = (value[0] - total, value[1] - count)
+            elif value != (written or 0):
+                changes[key] = value - (written or 0)
+        return changes
+
+    def write_textfile(self, file_path):
+        """Merge new metrics into the textfile collector file atomically.
+
+        Counters and summaries are added to the totals already in the file
+        and gauges replace them, so commands that run between syncs keep
+        earlier values intact. Nothing is written if nothing changed.
+        """
+        with self._lock:
+            values = dict(self._values)
+        changes = self._unwritten(values)
+        if not changes:
+            return
+
+        # Serialize the read-merge-write with other processes
+        with open(f'{file_path}.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(file_path) as f:
+                    merged = self._parse(f.read())
+            except FileNotFoundError:
+                merged = {}
+            for key, value in changes.items():
+                kind = METRICS[key[0]][0]
+                if kind == 'gauge' or key not in merged:
+                    merged[key] = value
+                elif kind == 'summary':
+                    merged[key] = tuple(map(sum, zip(merged[key], value)))
+                else:
+                    merged[key] += value
+
+            tmp_path = f'{file_path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w') as f:
+                f.write(self.render(merged))
+            os.replace(tmp_path, file_path)
+        self._written = values
+
+    def serve(self, port, host=''):
+        """Serve metrics over HTTP at /metrics from a background thread."""
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """Respond to Prometheus scrapes."""
+            def do_GET(self):
+                """Return the current metrics."""
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type',
+                                 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                """Keep scrapes out of the command output."""
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        Thread(target=server.serve_forever, daemon=True).start()
+        return server
@@ -0,0 +1,153 @@
+"""
+Copyright (C) 2021 Erin Morelli.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see [https://www.gnu.org/licenses/].
+"""
+
+import os
+import struct
+import shutil
+import subprocess
+
+from sqlalchemy import (Table, Column, BigInteger, DateTime, Integer, String,
+                        func)
+
+from rlm_patreon.checksum import hash_file
+
+
+# Name of the in-place remux step that moves the moov atom to the front
+FASTSTART = 'faststart'
+# Transcode profiles as ffmpeg output arguments
+PROFILES = {
+    '1080p': ['-vf', 'scale=-2:min(1080\\,ih)', '-c:v', 'libx264',
+              '-preset', 'medium', '-crf', '22',
+              '-c:a', 'aac', '-b:a', '160k'],
+    '720p': ['-vf', 'scale=-2:min(720\\,ih)', '-c:v', 'libx264',
+             '-preset', 'medium', '-crf', '23',
+             '-c:a', 'aac', '-b:a', '128k'],
+    '480p': ['-vf', 'scale=-2:min(480\\,ih)', '-c:v', 'libx264',
+             '-preset', 'fast', '-crf', '25',
+             '-c:a', 'aac', '-b:a', '96k']
+}
+
+
+class ProcessError(Exception):
+    """Raised when a video could not be processed."""
+
+
+def find_ffmpeg():
+    """Locate the ffmpeg binary on the PATH."""
+    return shutil.which('ffmpeg')
+
+
+def _read_exact(f, size):
+    """Read a box header field, rejecting files that end part way."""
+    data = f.read(size)
+    if len(data) != size:
+        raise ProcessError(f'Truncated MP4 box header in {f.name}')
+    return data
+
+
+def needs_faststart(file_path):
+    """Check whether an MP4 file stores its moov atom after the media."""
+    with open(file_path, 'rb') as f:
+        while True:
+            # A clean end of file means neither box was found
+            if not f.peek(1)[:1]:
+                return False
+            size, kind = struct.unpack('>I4s', _read_exact(f, 8))
+            if kind == b'moov':
+                return False
+            if kind == b'mdat':
+                return True
+            # Handle 64-bit and to-end-of-file box sizes
+            header_size = 8
+            if size == 1:
+                size = struct.unpack('>Q', _read_exact(f, 8))[0]
+                header_size = 16
+            elif size == 0:
+                return False
+            if size < header_size:
+                raise ProcessError(f'Invalid MP4 box size in {file_path}')
+            f.seek(size - header_size, os.SEEK_CUR)
+
+
+def output_path(file_path, profile):
+    """Location of a transcoded copy of a video."""
+    base_dir, file_name = os.path.split(file_path)
+    stem = os.path.splitext(file_name)[0]
+    return os.path.join(base_dir, 'Proxies', f'{stem} [{profile}].mp4')
+
+
+def _run_ffmpeg(ffmpeg, src, dest, args, threads):
+    """Run ffmpeg into a temporary file and move it into place."""
+    tmp_path = f'{dest}.tmp.mp4'
+    cmd = [ffmpeg, '-nostdin', '-v', 'error', '-y', '-i', src,
+           '-threads', str(threads), *args, '-movflags', '+faststart',
+           tmp_path]
+    try:
+        subprocess.run(cmd, check=True, capture_output=True)
+    except subprocess.CalledProcessError as exc:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        message = exc.stderr.decode(errors='replace').strip()
+        raise ProcessError(message or f'ffmpeg exited with {exc.returncode}')
+    os.replace(tmp_path, dest)
+
+
+def process_video(job):
+    """Run each processing step for one video.
+
+    Runs in a worker process, so it only takes and returns plain data.
+    """
+    file_path = job['file_path']
+    results = []
+
+    try:
+        checksum = job['checksum'] or hash_file(file_path)
+        for step in job['steps']:
+            if step == FASTSTART:
+                # Remux in place when the file is not already streamable
+                source = checksum
+                if needs_faststart(file_path):
+                    _run_ffmpeg(job['ffmpeg'], file_path, file_path,
+                                ['-c', 'copy'], job['threads'])
+                    checksum = hash_file(file_path)
+                results.append((step, file_path, checksum, source))
+            else:
+                dest = output_path(file_path, step)
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                _run_ffmpeg(job['ffmpeg'], file_path, dest, PROFILES[step],
+                            job['threads'])
+                results.append((step, dest, hash_file(dest), checksum))
+    except (ProcessError, OSError) as exc:
+        return job['video_id'], results, str(exc)
+
+    return job['video_id'], results, None
+
+
+def table(metadata):
+    """Processed video outputs database table definition."""
+    return Table(
+        'video_outputs',
+        metadata,
+        Column('video_id', Integer, primary_key=True),
+        Column('profile', String, primary_key=True),
+        Column('file_path', String, nullable=False),
+        Column('file_size', BigInteger, nullable=True),
+        Column('checksum', String, nullable=True),
+        Column('source_checksum', String, nullable=True),
+        Column('last_updated', DateTime, server_default=func.now(),
+               onupdate=func.now(), nullable=False)
+    )
@@ -0,0 +1,116 @@
+"""
+Copyright (C) 2021 Erin Morelli.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see [https://www.gnu.org/licenses/].
+"""
+
+import os
+import time
+import sqlite3
+
+
+class RateLimiter:
+    """Token bucket rate limiter shared by every process via SQLite.
+
+    State lives in its own database file so waiting on a bucket never
+    contends with an open transaction on the content database.
+    """
+    # Override limits with e.g. "api=10/5,login=1/300" (requests/seconds)
+    limits_env_var = 'RLM_PM_RATE_LIMITS'
+    # Default budgets per endpoint class as (requests, per seconds)
+    default_limits = {
+        'api': (5, 5.0),
+        'login': (2, 600.0),
+        'vimeo': (4, 2.0)
+    }
+
+    def __init__(self, db_path):
+        """Setup details for the limiter."""
+        self.db_path = db_path
+        self.limits = dict(self.default_limits)
+        self.limits.update(self.parse_limits(
+            os.environ.get(self.limits_env_var, None) or ''))
+
+    @staticmethod
+    def parse_limits(value):
+        """Parse a "bucket=requests/seconds,..." limits string."""
+        limits = {}
+        for item in filter(None, value.split(',')):
+            try:
+                bucket, budget = item.split('=')
+                requests, seconds = budget.split('/')
+                limits[bucket.strip()] = (int(requests), float(seconds))
+            except ValueError as exc:
+                raise ValueError(f'Invalid rate limit: {item}') from exc
+        return limits
+
+    def _connect(self):
+        """Open a connection that manages its own transactions."""
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS rate_limits ('
+            'bucket VARCHAR PRIMARY KEY, tokens FLOAT NOT NULL, '
+            'updated FLOAT NOT NULL)')
+        return conn
+
+    def _update(self, bucket, fn):
+        """Refill a bucket and apply a change under a database write lock."""
+        capacity, period = self.limits[bucket]
+        rate = capacity / period
+        conn = self._connect()
+        try:
+            # Take the write lock up front so processes queue on the bucket
+            conn.execute('BEGIN IMMEDIATE')
+            now = time.time()
+            row = conn.execute(
+                'SELECT tokens, updated FROM rate_limits WHERE bucket = ?',
+                (bucket,)).fetchone()
+            tokens, updated = row if row else (capacity, now)
+            tokens = min(capacity, tokens + max(0.0, now - updated) * rate)
+            tokens, result = fn(tokens, rate)
+            conn.execute(
+                'INSERT OR REPLACE INTO rate_limits (bucket, tokens, updated) '
+                'VALUES (?, ?, ?)', (bucket, tokens, now))
+            conn.execute('COMMIT')
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        return result
+
+    @staticmethod
+    def _take(tokens, rate):
+        """Take a token, or work out how long until one is available."""
+        if tokens >= 1:
+            return tokens - 1, 0.0
+        return tokens, (1 - tokens) / rate
+
+    def acquire(self, bucket):
+        """Block until a request for this endpoint class is allowed."""
+        if bucket not in self.limits:
+            return
+        while True:
+            wait = self._update(bucket, self._take)
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def penalize(self, bucket, seconds):
+        """Empty a bucket so no process uses it for a number of seconds."""
+        if bucket not in self.limits:
+            return
+        self._update(bucket, lambda tokens, rate: (
+            min(tokens, 1 - seconds * rate), None))
@@ -0,0 +1,111 @@
+"""
+Copyright (C) 2021 Erin Morelli.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see [https://www.gnu.org/licenses/].
+"""
+
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from sqlalchemy import Table, Column, BigInteger, String, Text
+
+
+class DirectoryScanner:
+    """Parallel directory walker that caches listings by directory mtime."""
+    model_name = 'scan_cache'
+    # Suffixes of partial files written by downloads and processing
+    ignore_suffixes = ('.part', '.tmp', '.tmp.mp4')
+
+    def __init__(self, manager, db, workers=8):
+        """Setup details for the scanner."""
+        self.manager = manager
+        self.db = db
+        self.model = self.manager.models.get(self.model_name)
+        self.workers = workers
+        self.rescanned = 0
+
+    def _list_dir(self, path, cached):
+        """List a directory, reusing the cached listing if unchanged."""
+        mtime = os.stat(path).st_mtime_ns
+        if cached and cached[0] == mtime:
+            return path, mtime, cached[1], cached[2], False
+
+        # The directory changed, so read it and stat its files
+        files, subdirs = [], []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.is_file() and \
+                        not entry.name.endswith(self.ignore_suffixes):
+                    stat = entry.stat()
+                    files.append([entry.name, stat.st_size])
+        return path, mtime, files, subdirs, True
+
+    def walk(self, root):
+        """Get the size of every file under a directory, keyed by path."""
+        cache = {row.path: (row.mtime, json.loads(row.files),
+                            json.loads(row.subdirs))
+                 for row in self.db.query(self.model)}
+        results = {}
+
+        # Traverse breadth-first, listing sibling directories concurrently
+        with ThreadPoolExecutor(self.workers) as pool:
+            pending = {pool.submit(self._list_dir, root, cache.get(root))}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        path, mtime, files, subdirs, changed = future.result()
+                    except OSError:
+                        # Skip directories that vanished or are unreadable
+                        continue
+                    results[path] = mtime, files, subdirs, changed
+                    pending |= {pool.submit(self._list_dir, sub,
+                                            cache.get(sub))
+                                for sub in subdirs}
+
+        # Store listings for changed directories and drop vanished ones
+        for path, (mtime, files, subdirs, changed) in results.items():
+            if changed:
+                self.rescanned += 1
+                self.db.merge(self.model(
+                    path=path,
+                    mtime=mtime,
+                    files=json.dumps(files),
+                    subdirs=json.dumps(subdirs)
+                ))
+        prefix = os.path.join(root, '')
+        for path in cache:
+            if (path == root or path.startswith(prefix)) and \
+                    path not in results:
+                self.db.query(self.model).filter_by(path=path).delete()
+        self.db.commit()
+
+        return {os.path.join(path, name): size
+                for path, (_, files, _, _) in results.items()
+                for name, size in files}
+
+    @staticmethod
+    def table(metadata):
+        """Directory scan cache database table definition."""
+        return Table(
+            'scan_cache',
+            metadata,
+            Column('path', String, primary_key=True),
+            Column('mtime', BigInteger, nullable=False),
+            Column('files', Text, nullable=False),
+            Column('subdirs', Text, nullable=False)
+        )
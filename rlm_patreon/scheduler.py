@@ -0,0 +1,108 @@
+"""
+Copyright (C) 2021 Erin Morelli.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see [https://www.gnu.org/licenses/].
+"""
+
+import random
+from datetime import datetime, timedelta
+from statistics import median
+
+
+class PollScheduler:
+    """Pick polling delays from a campaign's past publishing cadence."""
+    # Hours either side of a typical release time that count as active
+    window_hours = 2
+    # Growth factor applied to the delay after each empty poll
+    backoff = 1.5
+
+    def __init__(self, published, min_interval=600, max_interval=21600,
+                 jitter=0.2):
+        """Setup details for the scheduler.
+
+        `published` is a list of naive UTC datetimes. Entries at exactly
+        midnight are treated as date-only and only inform the weekday.
+        """
+        self.published = sorted(published)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.jitter = jitter
+        self.misses = 0
+
+    def _median_gap(self):
+        """Typical time between releases, if there is enough history."""
+        if len(self.published) < 2:
+            return None
+        gaps = [b - a for a, b in zip(self.published, self.published[1:])]
+        return median(gaps)
+
+    def _activity(self, now):
+        """How typical a release is around this weekday and time, 0-1."""
+        if not self.published:
+            return 0.0
+
+        # Count releases falling into each weekday and hour slot
+        slots = {}
+        for when in self.published:
+            has_time = when.time() != datetime.min.time()
+            hours = range(24) if not has_time else [when.hour]
+            for hour in hours:
+                key = (when.weekday(), hour)
+                slots[key] = slots.get(key, 0) + 1
+
+        # Sum the slots in a window around now and scale to the busiest
+        def score(moment):
+            total = 0
+            for offset in range(-self.window_hours, self.window_hours + 1):
+                slot = moment + timedelta(hours=offset)
+                total += slots.get((slot.weekday(), slot.hour), 0)
+            return total
+
+        busiest = max(score(datetime(2021, 1, 4) + timedelta(hours=h))
+                      for h in range(7 * 24))
+        return score(now) / busiest if busiest else 0.0
+
+    def _overdue(self, now):
+        """How close we are to the next expected release, 0-1."""
+        gap = self._median_gap()
+        if not gap:
+            return 0.0
+        ratio = max(0.0, (now - self.published[-1]) / gap)
+        # Peak when a release is due, then fade during long quiet spells
+        return ratio if ratio <= 1 else 1 / ratio
+
+    def record(self, found, now=None):
+        """Record the outcome of a poll."""
+        now = now or datetime.utcnow()
+        if found:
+            self.published.append(now)
+            self.misses = 0
+        else:
+            self.misses += 1
+
+    def next_delay(self, now=None):
+        """Seconds to wait before the next poll."""
+        now = now or datetime.utcnow()
+        urgency = max(self._activity(now), self._overdue(now))
+
+        # The likelier a release is, the lower the delay is allowed to grow
+        span = self.max_interval - self.min_interval
+        ceiling = self.max_interval - span * urgency
+
+        # Back off from the minimum while polls keep coming up empty
+        delay = self.min_interval * self.backoff ** min(self.misses, 32)
+        delay = min(ceiling, delay)
+
+        # Spread polls out so they do not line up on the same second
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
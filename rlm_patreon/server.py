@@ -0,0 +1,219 @@
+"""
+Copyright (C) 2021 Erin Morelli.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see [https://www.gnu.org/licenses/].
+"""
+
+import os
+import re
+import json
+import mimetypes
+from html import escape
+from threading import Lock
+from urllib.parse import urlparse, parse_qs, urlencode
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class LibraryServer(ThreadingHTTPServer):
+    """Threaded HTTP server for the downloaded video library."""
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address, content):
+        """Setup details for the server."""
+        super().__init__(address, LibraryHandler)
+        self.content = content
+        # The catalog shares one database session between request threads
+        self.db_lock = Lock()
+
+    def page(self, **kwargs):
+        """Get a page of downloaded videos from the catalog."""
+        with self.db_lock:
+            try:
+                videos, next_id = self.content.find_videos(
+                    downloaded=True, **kwargs)
+                return [self.content.video_data(v) for v in videos], next_id
+            finally:
+                # Drop cached rows so changes from other processes show up
+                self.content.db.close()
+
+    def file_path(self, video_id):
+        """Get the local file for a video, if it has been downloaded."""
+        with self.db_lock:
+            try:
+                video = self.content.db.query(self.content.model).get(video_id)
+                return video.file_path if video else None
+            finally:
+                self.content.db.close()
+
+    def thumbnail_path(self, video_id):
+        """Get the cached thumbnail for a video, fetching it if needed."""
+        with self.db_lock:
+            try:
+                video = self.content.db.query(self.content.model).get(video_id)
+                url = self.content.video_data(video)['thumbnail_url'] \
+                    if video else None
+                return self.content.thumbnails.get(url) if url else None
+            finally:
+                self.content.db.close()
+
+
+class LibraryHandler(BaseHTTPRequestHandler):
+    """Serve the catalog as HTML/JSON and stream video files."""
+    protocol_version = 'HTTP/1.1'
+    range_pattern = re.compile(r'^bytes=(\d*)-(\d*)$')
+    # Default and largest number of videos returned per page
+    page_size = 50
+    max_page_size = 500
+
+    def log_message(self, *args):
+        """Keep request logs out of the command output."""
+
+    def _send_body(self, status, content_type, body):
+        """Send a complete in-memory response."""
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _params(self):
+        """Get the last value of each query string parameter."""
+        return {k: v[-1] for k, v in
+                parse_qs(urlparse(self.path).query).items()}
+
+    def _query(self):
+        """Parse listing options from the query string."""
+        params = self._params()
+        after_id = params.get('after_id')
+        number = int(params.get('number', self.page_size))
+        return {
+            'number': min(max(1, number), self.max_page_size),
+            'search': params.get('search'),
+            'after_id': int(after_id) if after_id else None,
+            'oldest': params.get('sort') == 'oldest'
+        }
+
+    @staticmethod
+    def _row(video):
+        """Render one video in the library page."""
+        # Thumbnails come from the local cache rather than Patreon's CDN
+        image = f'<img src="/videos/{video["id"]}/thumbnail" alt="" ' \
+            'width="160" loading="lazy"> ' if video['thumbnail_url'] else ''
+        return (
+            f'<li>{image}<a href="/videos/{video["id"]}">'
+            f'{escape(video["title"])}</a> <small>{video["date"]}</small>'
+            f'<p>{escape(video["description"] or "")}</p></li>')
+
+    def _index(self):
+        """Render a browsable page of the library."""
+        query = self._query()
+        videos, next_id = self.server.page(**query)
+        rows = ''.join(self._row(video) for video in videos)
+        more = ''
+        if next_id is not None:
+            # Keep the sort, search and page size when following the cursor
+            params = dict(self._params(), after_id=next_id)
+            more = f'<a href="/?{escape(urlencode(params))}">Next page</a>'
+        self._send_body(200, 'text/html; charset=utf-8', (
+            '<!doctype html><meta charset="utf-8">'
+            '<title>RLM Patreon Library</title>'
+            f'<h1>RLM Patreon Library</h1><ul>{rows}</ul>{more}'))
+
+    def _list(self):
+        """Return a page of the library as JSON."""
+        videos, next_id = self.server.page(**self._query())
+        self._send_body(200, 'application/json', json.dumps({
+            'videos': videos,
+            'next_cursor': next_id
+        }))
+
+    def _byte_range(self, size):
+        """Get the requested (start, end) byte range, or None for all."""
+        header = self.headers.get('Range')
+        match = self.range_pattern.match(header or '')
+        if not match:
+            return None
+        first, last = match.groups()
+        if not first:
+            # Suffix range for the final bytes of the file
+            if not last or not int(last):
+                raise ValueError(header)
+            return max(0, size - int(last)), size - 1
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if start > end:
+            raise ValueError(header)
+        return start, end
+
+    def _stream(self, file_path):
+        """Stream a local file, honoring single byte range requests."""
+        if not file_path or not os.path.isfile(file_path):
+            self.send_error(404)
+            return
+
+        with open(file_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            try:
+                byte_range = self._byte_range(size)
+            except ValueError:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+
+            # Send headers for either the full file or the partial content
+            start, end = byte_range or (0, size - 1)
+            self.send_response(206 if byte_range else 200)
+            if byte_range:
+                self.send_header('Content-Range',
+                                 f'bytes {start}-{end}/{size}')
+            content_type = mimetypes.guess_type(file_path)[0]
+            self.send_header('Content-Type',
+                             content_type or 'application/octet-stream')
+            self.send_header('Content-Length', str(end - start + 1))
+            self.send_header('Accept-Ranges', 'bytes')
+            self.end_headers()
+            if self.command == 'HEAD' or size == 0:
+                return
+
+            # Let the kernel copy the file straight to the socket
+            self.wfile.flush()
+            try:
+                self.connection.sendfile(f, start, end - start + 1)
+            except (BrokenPipeError, ConnectionResetError):
+                self.close_connection = True
+
+    def do_GET(self):
+        """Route a request."""
+        path = urlparse(self.path).path
+        match = re.match(r'^/videos/(\d+)(/thumbnail)?$', path)
+        try:
+            if path == '/':
+                self._index()
+            elif path == '/api/videos':
+                self._list()
+            elif match and match.group(2):
+                self._stream(self.server.thumbnail_path(int(match.group(1))))
+            elif match:
+                self._stream(self.server.file_path(int(match.group(1))))
+            else:
+                self.send_error(404)
+        except ValueError as exc:
+            self.send_error(400, str(exc))
+
+    do_HEAD = do_GET
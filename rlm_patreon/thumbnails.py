@@ -0,0 +1,158 @@
+"""
+Copyright (C) 2021 Erin Morelli.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see [https://www.gnu.org/licenses/].
+"""
+
+import os
+import hashlib
+import mimetypes
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from requests import Session, RequestException
+from sqlalchemy import Table, Column, BigInteger, DateTime, String, func
+
+
+class ThumbnailCache:
+    """Content-addressed, size-bounded LRU cache of thumbnail images."""
+    model_name = 'thumbnails'
+    # Byte budget for the cache, override with the environment variable
+    size_env_var = 'RLM_PM_THUMBNAIL_CACHE_SIZE'
+    size_default = 256 * 1024 * 1024
+    # Number of images to fetch at once
+    workers = 8
+
+    def __init__(self, manager, db, headers=None):
+        """Setup details for the cache."""
+        self.manager = manager
+        self.db = db
+        self.model = self.manager.models.get(self.model_name)
+        self.cache_dir = os.path.join(manager.config_path, 'thumbnails')
+        self.max_bytes = int(
+            os.environ.get(self.size_env_var, None) or self.size_default)
+        self.headers = headers or {}
+
+    def _file_path(self, digest, extension):
+        """Location of a cached image, sharded by digest prefix."""
+        return os.path.join(self.cache_dir, digest[:2], digest + extension)
+
+    def _fetch(self, session, url):
+        """Download an image and store it under its content digest."""
+        res = session.get(url, timeout=30)
+        res.raise_for_status()
+
+        # Name the file by its content so duplicates share storage
+        digest = hashlib.sha256(res.content).hexdigest()
+        content_type = res.headers.get('Content-Type', '').split(';')[0]
+        extension = mimetypes.guess_extension(content_type) or ''
+        file_path = self._file_path(digest, extension)
+
+        # Write atomically so readers never see a partial image
+        if not os.path.isfile(file_path):
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            tmp_path = f'{file_path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(res.content)
+            os.replace(tmp_path, file_path)
+
+        return url, file_path, digest, len(res.content)
+
+    def _lookup(self, url):
+        """Find a cached entry whose file is still on disk."""
+        entry = self.db.query(self.model).get(url)
+        if entry and not os.path.isfile(entry.file_path):
+            self.db.delete(entry)
+            return None
+        return entry
+
+    def fetch_many(self, urls):
+        """Concurrently cache any images that are not already stored."""
+        missing = {url for url in urls if url and not self._lookup(url)}
+        if not missing:
+            return 0
+
+        session = Session()
+        session.headers = self.headers
+
+        def fetch(url):
+            try:
+                return self._fetch(session, url)
+            except (RequestException, OSError):
+                return None
+
+        # Only the download happens in worker threads, not the DB writes
+        with ThreadPoolExecutor(self.workers) as pool:
+            results = [r for r in pool.map(fetch, missing) if r]
+        for url, file_path, digest, size in results:
+            self.db.add(self.model(
+                url=url,
+                file_path=file_path,
+                digest=digest,
+                size=size
+            ))
+        self.db.commit()
+        self.evict()
+        return len(results)
+
+    def get(self, url, fetch=True):
+        """Get the local path for an image, fetching it if needed."""
+        entry = self._lookup(url)
+        if not entry and not fetch:
+            return None
+        if not entry:
+            self.fetch_many([url])
+            entry = self._lookup(url)
+            if not entry:
+                return None
+        # Mark the entry as recently used
+        entry.last_accessed = datetime.utcnow()
+        self.db.commit()
+        return entry.file_path
+
+    def evict(self):
+        """Remove least recently used images until within budget."""
+        entries = self.db.query(self.model) \
+            .order_by(self.model.last_accessed.asc()).all()
+        sizes = {entry.digest: entry.size for entry in entries}
+        refs = {}
+        for entry in entries:
+            refs[entry.digest] = refs.get(entry.digest, 0) + 1
+        total = sum(sizes.values())
+
+        for entry in entries:
+            if total <= self.max_bytes:
+                break
+            self.db.delete(entry)
+            refs[entry.digest] -= 1
+            # Only remove the file once nothing else points at it
+            if not refs[entry.digest]:
+                total -= sizes[entry.digest]
+                if os.path.isfile(entry.file_path):
+                    os.remove(entry.file_path)
+        self.db.commit()
+
+    @staticmethod
+    def table(metadata):
+        """Thumbnail cache database table definition."""
+        return Table(
+            'thumbnails',
+            metadata,
+            Column('url', String, primary_key=True),
+            Column('file_path', String, nullable=False),
+            Column('digest', String, nullable=False, index=True),
+            Column('size', BigInteger, nullable=False),
+            Column('last_accessed', DateTime, server_default=func.now(),
+                   nullable=False)
+        )
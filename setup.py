@@ -49,4 +49,8 @@ setup(
         'vimeo-downloader',
         'yaspin'
     ],
+    extras_require={
+        'brotli': ['brotli'],
+        'zstd': ['zstandard']
+    },
 )